@@ -15,14 +15,30 @@
 # ------------------------------------------------------------------------
 
 import argparse
+import concurrent.futures
 import datetime
+import functools
 import logging
+import mmap
 import os
+import posixpath
 import re
 import subprocess
 import sys
 import tarfile
 import sqlite3
+import stat
+
+try:
+  import ahocorasick
+except ImportError:
+  ahocorasick = None
+
+# Month abbreviations in log timestamps, e.g. Nov 22 00:00:00
+MONTHS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12
+}
 
 
 class LogParser():
@@ -38,10 +54,28 @@ class LogParser():
     output_file: String for output file name
     open_file: Boolean to open the output file with default program
     debug: Boolean to list debug info
-    pacemaker_log_keywords: String for keywords to filter pacemaker logs
-    system_log_keywords: String for keywords to filter system logs
+    pacemaker_log_keywords: String for regex of keywords to filter pacemaker logs
+    system_log_keywords: String for regex of keywords to filter system logs
+    _pac_keywords: List of strings for keywords to filter pacemaker logs
+    _sys_keywords: List of strings for keywords to filter system logs
+    _bytes_re_by_type: Dict of compiled bytes regex of the keywords by log type
+    _pac_ac: Aho-Corasick automaton of _pac_keywords, or None
+    _sys_ac: Aho-Corasick automaton of _sys_keywords, or None
+    _line_filter_by_type: Dict of functions by log type to check if a bytes
+      log line contains keywords
+    _ts_re1: Compiled regex for timestamp format Nov 22 00:00:00
+    _ts_re2: Compiled regex for timestamp format 2020-11-22T00:00:00
+    _year: Integer for current year, used for timestamps without year
+    _format_ts1: Cached format_timestamp1 of this instance
+    _format_ts2: Cached format_timestamp2 of this instance
+    _bracket_re: Compiled regex for '[number]' in log line
+    _leading_pid_re: Compiled regex for '[number]' at the start of PAYLOAD
+    _ws_re: Compiled regex to split log line by whitespace
     conn: DB connection to temp in memory DB
     sql_query: String for SQL to select critical events
+    _index_time: Boolean whether to index column TIME for sql_query
+    _batch: List of parsed records waiting to be inserted into the DB
+    _BATCH_SIZE: Integer for number of records to insert in one transaction
   """
 
   def __init__(self, variables):
@@ -81,75 +115,113 @@ class LogParser():
         logging.info('Please input max two sosreport from two nodes.')
         sys.exit()
 
-    self.pacemaker_log_keywords = (
-        'LogAction|LogNodeActions|stonith-ng|pacemaker-fenced|check_migration_threshold|corosync|Result'
-        ' of|reboot|cannot run anywhere|attrd_peer_update|High CPU load detected|cli-ban|cli-prefer'
-        'cib-bootstrap-options-maintenance-mode|-is-managed|-maintenance|-standby')
-    self.system_log_keywords = (
-        r'SAPHana\(|SAPHanaController\(|SAPHanaTopology\(|SAPInstance\(|gcp-vpc-move-vip|gcp:alias|gcp:stonith|fence_gce|corosync\[|Result'
-        ' of|reboot')
+    # Keywords to filter the logs, the most frequent ones first
+    self._pac_keywords = [
+        'Result of', 'corosync', 'LogAction', 'LogNodeActions',
+        'attrd_peer_update', 'stonith-ng', 'pacemaker-fenced', 'reboot',
+        '-standby', '-maintenance', '-is-managed', 'crit:',
+        'check_migration_threshold', 'cannot run anywhere',
+        'High CPU load detected', 'cli-ban', 'cli-prefer',
+        'cib-bootstrap-options-maintenance-mode'
+    ]
+    self._sys_keywords = [
+        'Result of', 'corosync[', 'reboot', 'SAPHana(', 'SAPHanaController(',
+        'SAPHanaTopology(', 'SAPInstance(', 'gcp-vpc-move-vip', 'gcp:alias',
+        'gcp:stonith', 'fence_gce'
+    ]
+    self.pacemaker_log_keywords = self.build_keyword_regex(self._pac_keywords)
+    self.system_log_keywords = self.build_keyword_regex(self._sys_keywords)
+
+    # Compile the regular expressions used for every log line once
+    # The keywords are ASCII, searching them in UTF-8 bytes gives the same
+    # result as in decoded text, so only matched lines need to be decoded
+    self._bytes_re_by_type = {
+        's': re.compile(self.system_log_keywords.encode()),
+        'p': re.compile(self.pacemaker_log_keywords.encode())
+    }
+    self.build_keyword_filters()
+    # time format Nov 22 00:00:00
+    self._ts_re1 = re.compile(r'(\w{3})\s+(\d+)\s(\d\d):(\d\d):(\d\d)')
+    # time format 2020-11-22T00:00:00
+    self._ts_re2 = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)')
+    self._year = datetime.datetime.now().year
+    self.build_timestamp_caches()
+    self._bracket_re = re.compile(r'\[\d*\]')
+    self._leading_pid_re = re.compile(r'^\[\d*\]\s*')
+    self._ws_re = re.compile(r'\s+')
 
-    # Generate the big sql query
-    time = ''
-    table = 'log'
-    # Generate the string to filter column TIME
-    if variables.b:
-      time = 'WHERE TIME > \'' + str(self.date_begin) + '\''
-      if variables.e:
-        time += ' AND TIME < \'' + str(self.date_end) + '\''
-    elif variables.e:
-      time = 'WHERE TIME < \'' + str(self.date_end) + '\''
+    # Create an in-memory DB and a table 'log'
+    try:
+      # Disable the implicit transactions, the inserts are done in explicit ones
+      self.conn = sqlite3.connect(':memory:', isolation_level=None)
+      # The DB only lives in memory, durability is not needed
+      self.conn.execute('PRAGMA synchronous=OFF')
+      self.conn.execute('PRAGMA journal_mode=MEMORY')
+      self.conn.execute(
+          'CREATE TABLE log (TIME TEXT, NODE TEXT, COMPONENT TEXT, PAYLOAD TEXT)')
+    except sqlite3.Error as err:
+      logging.error('Error creating the DB and table: %s.', str(err))
+      sys.exit()
 
+    # Generate the big sql query
     sql = []
-    statement = 'SELECT TIME, NODE, COMPONENT, PAYLOAD FROM('
-    if time:
-      statement += (
-          'WITH data as (SELECT rowid, TIME, NODE, COMPONENT, PAYLOAD '
-          'FROM log ') + time + ') '
-      table = 'data'
     # Fencing actions & results, stonith timeout
     sql.append(
-        'SELECT rowid, TIME, NODE, COMPONENT, PAYLOAD FROM ' + table +
-        " WHERE PAYLOAD LIKE '%$*%FENCE%' ESCAPE '$' OR PAYLOAD LIKE '%remote_op_done%Operation%' OR PAYLOAD LIKE '%monitor%Timer%expired%'"
+        "PAYLOAD LIKE '%$*%FENCE%' ESCAPE '$' OR PAYLOAD LIKE '%remote_op_done%Operation%' OR PAYLOAD LIKE '%monitor%Timer%expired%'"
     )
     # Pacemaker actions for resources, CRMD critical logs, high CPU load
     sql.append(
-        'SELECT rowid, TIME, NODE, COMPONENT, PAYLOAD FROM ' + table +
-        " WHERE PAYLOAD LIKE '%notice%LogAction%' OR PAYLOAD LIKE '%(LogAction)%' OR PAYLOAD LIKE '%crit:%' OR PAYLOAD LIKE '%Forcing%away%' OR PAYLOAD LIKE '%cannot%run%anywhere%' or PAYLOAD LIKE '%attrd_peer_update%INFINITY%' OR PAYLOAD LIKE '%CPU%detected%'"
+        "PAYLOAD LIKE '%notice%LogAction%' OR PAYLOAD LIKE '%(LogAction)%' OR PAYLOAD LIKE '%crit:%' OR PAYLOAD LIKE '%Forcing%away%' OR PAYLOAD LIKE '%cannot%run%anywhere%' or PAYLOAD LIKE '%attrd_peer_update%INFINITY%' OR PAYLOAD LIKE '%CPU%detected%'"
     )
     # Corosync error or membership change
     sql.append(
-        'SELECT rowid, TIME, NODE, COMPONENT, PAYLOAD FROM ' + table +
-        " WHERE PAYLOAD LIKE '%TOTEM%' AND (PAYLOAD LIKE '%failed%' OR PAYLOAD LIKE '%membership%' OR PAYLOAD LIKE '%Retransmit%')"
+        "PAYLOAD LIKE '%TOTEM%' AND (PAYLOAD LIKE '%failed%' OR PAYLOAD LIKE '%membership%' OR PAYLOAD LIKE '%Retransmit%')"
     )
     # Failed resource operations
     sql.append(
-        'SELECT rowid, TIME, NODE, COMPONENT, PAYLOAD FROM ' + table +
-        " WHERE PAYLOAD LIKE '%Result%of%operation%' AND PAYLOAD NOT LIKE '%ok%' AND PAYLOAD NOT LIKE '%Cancelled%' AND PAYLOAD NOT LIKE '%probe%'"
+        "PAYLOAD LIKE '%Result%of%operation%' AND PAYLOAD NOT LIKE '%ok%' AND PAYLOAD NOT LIKE '%Cancelled%' AND PAYLOAD NOT LIKE '%probe%'"
     )
     # SAPInstance, gcp:stonith, gcp:alias, gcp-vpc-move-vip,fence_gce error
     sql.append(
-        'SELECT rowid, TIME, NODE, COMPONENT, PAYLOAD FROM ' + table +
-        " WHERE (COMPONENT LIKE 'SAPInstance%' OR COMPONENT in ('stonith-ng', 'gcp:stonith','gcp:alias','gcp-vpc-move-vip','fence_gce')) AND (PAYLOAD LIKE '%ERROR%' or PAYLOAD LIKE '%Failed%')"
+        "(COMPONENT LIKE 'SAPInstance%' OR COMPONENT in ('stonith-ng', 'gcp:stonith','gcp:alias','gcp-vpc-move-vip','fence_gce')) AND (PAYLOAD LIKE '%ERROR%' or PAYLOAD LIKE '%Failed%')"
     )
     # SAPHANA error or warning
     sql.append(
-        'SELECT rowid, TIME, NODE, COMPONENT, PAYLOAD FROM ' + table +
-        " WHERE COMPONENT LIKE 'SAPHana%' AND (PAYLOAD LIKE '%ERROR:%' OR PAYLOAD LIKE '%WARNING:%' or PAYLOAD LIKE '%ACT%SFAIL%')"
+        "COMPONENT LIKE 'SAPHana%' AND (PAYLOAD LIKE '%ERROR:%' OR PAYLOAD LIKE '%WARNING:%' or PAYLOAD LIKE '%ACT%SFAIL%')"
     )
     # Cluster/Node/RSC maintenance/standby/manage mode change
     sql.append(
-        'SELECT rowid, TIME, NODE, COMPONENT, PAYLOAD FROM ' + table +
-        " WHERE PAYLOAD LIKE '%cib-bootstrap-options-maintenance-mode%value%' OR PAYLOAD LIKE '%cib_perform_op%nodes-%-maintenance%' or PAYLOAD LIKE '%cib_perform_op%nodes-%-standby%' or PAYLOAD LIKE '%cib_perform_op%meta_attributes-%'"
+        "PAYLOAD LIKE '%cib-bootstrap-options-maintenance-mode%value%' OR PAYLOAD LIKE '%cib_perform_op%nodes-%-maintenance%' or PAYLOAD LIKE '%cib_perform_op%nodes-%-standby%' or PAYLOAD LIKE '%cib_perform_op%meta_attributes-%'"
     )
     # Location constaint cli-ban or cli-perfer due to manual resource movement
     sql.append(
-        'SELECT rowid, TIME, NODE, COMPONENT, PAYLOAD FROM ' + table +
-        " WHERE PAYLOAD LIKE '%cli-ban%' OR PAYLOAD LIKE '%cli-prefer%'"
+        "PAYLOAD LIKE '%cli-ban%' OR PAYLOAD LIKE '%cli-prefer%'"
     )
 
-    # Assemble the SQL
-    statement = statement + ' UNION '.join(sql) + ' ORDER BY TIME, rowid)'
+    where = []
+    # Generate the string to filter column TIME
+    if variables.b:
+      where.append('TIME > \'' + str(self.date_begin) + '\'')
+    if variables.e:
+      where.append('TIME < \'' + str(self.date_end) + '\'')
+
+    # Assemble the SQL, all filters are checked in a single scan of the table
+    where.append('((' + ') OR ('.join(sql) + '))')
+    # The lines of a single log file are inserted in time order, so rowid
+    # order is enough and the rows are read without a sort step. Lines from
+    # several logs are merged by time, rowid keeps the order of equal times.
+    if (len(variables.s or []) + len(variables.p or []) == 1 and
+        not variables.hb and not variables.sos):
+      order = 'rowid'
+    else:
+      order = 'TIME, rowid'
+    # The TIME index only helps to read the rows in time order
+    self._index_time = order != 'rowid'
+
+    # Format the output lines in SQLite instead of joining the columns in Python
+    statement = ("SELECT TIME || ' ' || NODE || ' ' || COMPONENT || ' ' || "
+                 'PAYLOAD FROM log WHERE ' + ' AND '.join(where) +
+                 ' ORDER BY ' + order)
 
     self.sql_query = statement
     self.system_log = variables.s
@@ -160,15 +232,8 @@ class LogParser():
     self.output_file = variables.o
     self.open_file = variables.x
 
-    # Create an in-memory DB and a table 'log'
-    try:
-      self.conn = sqlite3.connect(':memory:')
-      self.conn.execute(
-          'CREATE TABLE log (TIME TEXT, NODE TEXT, COMPONENT TEXT, PAYLOAD TEXT)')
-      self.conn.commit()
-    except sqlite3.Error as err:
-      logging.error('Error creating the DB and table: %s.', str(err))
-      sys.exit()
+    self._batch = []
+    self._BATCH_SIZE = 10000
 
   def logparser(self):
     """Call individual functions to parse the logs.
@@ -178,14 +243,24 @@ class LogParser():
     """
     logging.info('Starting the log parser.')
 
-    if self.system_log:
-      self.logfile_parser(self.system_log, 's')
-    if self.pacemaker_log:
-      self.logfile_parser(self.pacemaker_log, 'p')
+    logfiles = [(log, 's') for log in self.system_log or []]
+    logfiles += [(log, 'p') for log in self.pacemaker_log or []]
+    if logfiles:
+      self.logfile_parser(logfiles)
     if self.hb_report:
       self.hb_report_parser(self.hb_report)
     if self.SOSREPORT:
       self.sosreport_parser(self.SOSREPORT)
+    self._flush()
+
+    # Index column TIME after all inserts, so the query can read the rows in
+    # time order and use the index for time range
+    if self._index_time:
+      try:
+        self.conn.execute('CREATE INDEX idx_log_time ON log(TIME)')
+      except sqlite3.Error as err:
+        logging.error('Error creating the index: %s.', str(err))
+
     if self.output_file:
       self.generate_output(self.output_file[0])
       if self.open_file:
@@ -210,182 +285,340 @@ class LogParser():
 
     self.cleanup()
 
-  def logfile_parser(self, files, log_type):
-    """Loop each log file and parse each log line.
+  def logfile_parser(self, files):
+    """Parse each log file in a separate process and insert the log lines.
 
     Args:
-      files: List of strings for log file names
-      log_type: String for type of log files, 'p' for pacamker logs, 's' for system logs
+      files: List of tuples for log file name and type of log file, 'p' for
+        pacamker logs, 's' for system logs
 
     Raises:
       OSError: An error occurred when opening the log file
     """
-    for log in files:
+    # A single file is parsed in this process, sending its records back from a
+    # worker costs more than it saves
+    if len(files) == 1:
+      log, log_type = files[0]
+      logging.info('Parsing %s.', log)
       try:
-        with open(log, 'r', errors='replace') as inputfile:
-          logging.info('Parsing %s.', log)
-          line = inputfile.readline()
-          while line:
-            self.parse_log_line(line, log_type)
-            line = inputfile.readline()
+        self.insert_records(self.read_log_file(log, log_type))
       except OSError:
         logging.error('Cannot find/open/read file: %s.', log)
+      return
+
+    workers = min(len(files), os.cpu_count() or 1)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+      futures = []
+      for log, log_type in files:
+        logging.info('Parsing %s.', log)
+        futures.append(executor.submit(self.read_log_file, log, log_type))
+      # Insert the results in the order of the files to keep the output stable
+      for (log, _), future in zip(files, futures):
+        try:
+          self.insert_records(future.result())
+        except OSError:
+          logging.error('Cannot find/open/read file: %s.', log)
+
+  def read_log_file(self, log, log_type):
+    """Memory map a log file and parse the log lines which contain key words.
+
+    The bytes regex of the key words searches the whole mapped file, each call
+    skips all non-matching lines in the regex engine. Only the matched lines
+    are sliced out, decoded and parsed. A pipe or other file which can't be
+    mapped is read in blocks like a file extracted from tar file.
+
+    Args:
+      log: String for log file name
+      log_type: String for type of log files, 'p' for pacamker logs, 's' for system logs
+
+    Returns:
+      List of tuples for parsed log lines
+
+    Raises:
+      OSError: An error occurred when opening the log file
+    """
+    records = []
+    with open(log, 'rb') as inputfile:
+      file_stat = os.fstat(inputfile.fileno())
+      if not stat.S_ISREG(file_stat.st_mode):
+        return self.extracted_file_parser(inputfile, log_type)
+      # An empty file can't be mapped
+      if not file_stat.st_size:
+        return records
+      with mmap.mmap(inputfile.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        keyword_search = self._bytes_re_by_type[log_type].search
+        parse_log_line = self.parse_log_line
+        match = keyword_search(mapped)
+        while match:
+          start = mapped.rfind(b'\n', 0, match.start()) + 1
+          end = mapped.find(b'\n', match.end())
+          if end == -1:
+            end = len(mapped)
+          record = parse_log_line(
+              mapped[start:end].decode('utf-8', errors='replace'))
+          if record:
+            records.append(record)
+          # Continue from the next line, a line is parsed only once
+          match = keyword_search(mapped, end + 1)
+    return records
 
   def hb_report_parser(self, filelist):
     """Parse hb_report in format tar.gz.
 
-    Extract the two cluster nodes from member.txt. If the file doesn't exist,
-    extract from description.txt. Then use the node name to go to individual
-    folder to parse pacemaker.log and messages. If messages is missing, parse
-    journal.log
+    Read the hb_report in one sequential pass. Extract the two cluster nodes
+    from member.txt. If the file doesn't exist, extract from description.txt.
+    Then use the node name to go to individual folder to parse pacemaker.log
+    and messages. If messages is missing, parse journal.log
 
     Args:
       file: String list for hb_report name
+    """
+    logs = {
+        '/pacemaker.log': 'p',
+        '/corosync.log': 'p',
+        '/messages': 's',
+        '/journal.log': 's'
+    }
+    for file in filelist:
+      result = self.tar_file_reader(file, logs,
+                                    ('/members.txt', '/description.txt'))
+      if result is None:
+        continue
+      folder, contents = result
+
+      # Get the node names from members.txt
+      members = []
+      lines = contents.get(f'{folder}/members.txt')
+      if lines is None:
+        logging.info('members.txt is missing.')
+      elif lines:
+        members = lines[0].split()
+
+      # Get the node names from description.txt if members.txt is missing
+      if not members:
+        lines = contents.get(f'{folder}/description.txt')
+        if lines is None:
+          logging.info(
+              'description.txt is missing, not able to identify cluster nodes'
+              '. Please manually extract the logs and parse them.')
+          continue
+        for description_line in lines:
+          if re.search('^(?!#####)System info', description_line):
+            members.append(description_line.split(' ').pop().strip(':\n'))
+
+      for member in members:
+        logging.info('Found node %s in %s.', member, file)
+        # Parse pacemaker.log
+        if not self.compressed_file_parser(contents, [folder, member, 'pacemaker.log'], 'SLES'):
+          self.compressed_file_parser(contents, [folder, member, 'corosync.log'], 'SLES')
+        # Parse system log /var/log/messages or jounal.log
+        if not self.compressed_file_parser(contents, [folder, member, 'messages'], 'SLES'):
+          self.compressed_file_parser(contents, [folder, member, 'journal.log'], 'SLES')
+
+  def tar_file_reader(self, file, logs, texts):
+    """Read the wanted files from a tar file in one sequential pass.
+
+    The tar file is opened in stream mode, so it is decompressed only once and
+    never seeks back to extract a file. Log files are parsed while the stream
+    is positioned on them, the small text files are kept as lines.
+
+    Args:
+      file: String for tar file name
+      logs: Dict of file name suffix to type of log files, 'p' for pacamker
+        logs, 's' for system logs
+      texts: Tuple of file name suffixes of text files to keep
+
+    Returns:
+      Tuple of string for the top folder, and dict of member name to list of
+      parsed log lines or list of text lines. None if the file cannot be read.
 
     Raises:
       ReadError: An error occured when opening the tar file
       FileNotFoundError: An error occured when the tar file doesn't exist
-      KeyError: An error occured when the file to extract was missing
+      EOFError: An error occured when the tar file is incomplete
     """
-    for file in filelist:
+    try:
+      t = tarfile.open(file, 'r|*', bufsize=1024 * 1024)
+    except tarfile.ReadError:
+      logging.error('Cannot read the file %s. '
+                    'Please manually extract the logs and parse them.', file)
+      return None
+    except FileNotFoundError:
+      logging.error('Cannot find the file %s. ', file)
+      return None
+
+    folder = None
+    contents = {}
+    links = {}
+    with t:
       try:
-        t = tarfile.open(file, 'r')
-      except tarfile.ReadError:
-        logging.error('Cannot read the file %s. '
-                      'Please manually extract the logs and parse them.', file)
-        continue
-      except FileNotFoundError:
-        logging.error('Cannot find the file %s. ', file)
-        continue
-      else:
-        members = []
-        with t:
-          # Get the node names from members.txt
-          try:
-            folder = os.path.commonprefix(t.getnames())
-            members = t.extractfile(f'{folder}/members.txt').readline().decode('utf-8').split()
-          except KeyError:
-            logging.info('members.txt is missing.')
-          except EOFError:
-            logging.info('%s is corrupted or incomplete, please try to uncompress and use option s or p to parse individual files', file)
+        for member in t:
+          if folder is None:
+            folder = self.tar_top_folder(member)
+          # Links can't be extracted from a stream, resolve them at the end
+          if member.issym():
+            links[member.name] = posixpath.normpath(
+                posixpath.join(posixpath.dirname(member.name), member.linkname))
+            continue
+          if member.islnk():
+            links[member.name] = member.linkname
+            continue
+          if not member.isfile():
             continue
+          if member.name.endswith(texts):
+            text = t.extractfile(member).read().decode('utf-8', errors='replace')
+            contents[member.name] = text.splitlines(True)
+            continue
+          for suffix, log_type in logs.items():
+            if member.name.endswith(suffix):
+              contents[member.name] = self.extracted_file_parser(
+                  t.extractfile(member), log_type)
+              break
+      except (EOFError, tarfile.ReadError):
+        logging.info('%s is corrupted or incomplete, please try to uncompress and use option s or p to parse individual files', file)
+        return None
+
+    for name, target in links.items():
+      if target in contents:
+        contents[name] = contents[target]
+    return folder or '', contents
+
+  def tar_top_folder(self, member):
+    """Get the top folder of a tar file from its first member.
+
+    Leading '.' path components are kept, e.g. ./hb_report for a tar file
+    created from ./hb_report, and . for one created with 'tar -C dir .'.
+
+    Args:
+      member: TarInfo of the first member in the tar file
 
-          # Get the node names from description.txt if members.txt is missing
-          if not members:
-            try:
-              description = t.extractfile(f'{folder}/description.txt')
-              description_line = description.readline().decode('utf-8')
-              while description_line:
-                if re.search('^(?!#####)System info', description_line):
-                  members.append(description_line.split(' ').pop().strip(':\n'))
-                description_line = description.readline().decode('utf-8')
-            except KeyError:
-              logging.info(
-                  'description.txt is missing, not able to identify cluster nodes'
-                  '. Please manually extract the logs and parse them.')
-              continue
-
-          for member in members:
-            logging.info('Found node %s in %s.', member, file)
-            # Parse pacemaker.log
-            if not self.compressed_file_parser(t, [folder, member, 'pacemaker.log'], 'SLES', 'p'):
-              self.compressed_file_parser(t, [folder, member, 'corosync.log'], 'SLES', 'p')
-            # Parse system log /var/log/messages or jounal.log
-            if not self.compressed_file_parser(t, [folder, member, 'messages'], 'SLES', 's'):
-              self.compressed_file_parser(t, [folder, member, 'journal.log'], 'SLES', 's')
-
-  def compressed_file_parser(self, file_handle, path, distro, log_type):
-    """Extract log file and parse each log line.
+    Returns:
+      String for the top folder
+    """
+    parts = member.name.split('/')
+    dots = 0
+    while dots < len(parts) and parts[dots] == '.':
+      dots += 1
+    # The first other component is a folder if the member is in it or is it
+    if len(parts) > dots + 1 or (len(parts) > dots and member.isdir()):
+      dots += 1
+    return '/'.join(parts[:dots])
+
+  def compressed_file_parser(self, contents, path, distro):
+    """Insert the parsed log lines of a file read from tar file.
 
     Args:
-      file_handle: File handle of the extracted hb_report
+      contents: Dict of member name to list of parsed log lines
       path: List of strings for the path
       distro: String for os RHEL or SLES
-      log_type: String for type of log files, 'p' for pacamker logs, 's' for system logs
 
     Returns:
       Boolean whether the file is successfully parsed.
-
-    Raises:
-      KeyError: An error occured when the file to extract was missing
     """
     if distro == 'SLES' and len(path) == 3:
-      try:
-        extractedfile = file_handle.extractfile(f'{path[0]}/{path[1]}/{path[2]}')
-        logging.info('Parsing %s from node %s.', path[2], path[1])
-        line = extractedfile.readline().decode('utf-8')
-        while line:
-          self.parse_log_line(line, log_type)
-          line = extractedfile.readline().decode('utf-8')
-        return True
-      except KeyError:
+      records = contents.get(f'{path[0]}/{path[1]}/{path[2]}')
+      if records is None:
         logging.info('%s not found for node %s.', path[2], path[1])
         return False
+      logging.info('Parsing %s from node %s.', path[2], path[1])
+      self.insert_records(records)
+      return True
 
     if distro == 'RHEL' and len(path) == 2:
-      try:
-        extractedfile = file_handle.extractfile(f'{path[0]}/{path[1]}')
-        logging.info('Parsing %s.', path[1])
-        line = extractedfile.readline().decode('utf-8')
-        while line:
-          self.parse_log_line(line, log_type)
-          line = extractedfile.readline().decode('utf-8')
-        return True
-      except KeyError:
+      records = contents.get(f'{path[0]}/{path[1]}')
+      if records is None:
         logging.info('%s not found in sosreport.', path[1])
         return False
+      logging.info('Parsing %s.', path[1])
+      self.insert_records(records)
+      return True
+
+  def extracted_file_parser(self, extractedfile, log_type):
+    """Parse each log line of a file extracted from tar file or a pipe.
+
+    The file is read in large blocks and the lines are filtered by key words
+    as bytes, with Aho-Corasick if pyahocorasick is installed. Only the
+    matched lines are decoded and parsed. TextIOWrapper
+    can't be used because the file extracted from a tar stream doesn't
+    support seekable().
+
+    Args:
+      extractedfile: File object of the extracted log file
+      log_type: String for type of log files, 'p' for pacamker logs, 's' for system logs
+
+    Returns:
+      List of tuples for parsed log lines
+    """
+    keyword_filter = self._line_filter_by_type[log_type]
+    parse_log_line = self.parse_log_line
+    records = []
+    for line in filter(keyword_filter, self.read_lines(extractedfile)):
+      record = parse_log_line(line.decode('utf-8', errors='replace'))
+      if record:
+        records.append(record)
+    return records
+
+  def read_lines(self, fileobj):
+    """Read a binary file in blocks and split it into lines.
+
+    Args:
+      fileobj: File object opened in binary mode
+
+    Yields:
+      Bytes for each line without the line break
+    """
+    rest = b''
+    block = fileobj.read(1024 * 1024)
+    while block:
+      lines = (rest + block).split(b'\n')
+      # The last line may continue in the next block
+      rest = lines.pop()
+      yield from lines
+      block = fileobj.read(1024 * 1024)
+    if rest:
+      yield rest
 
   def sosreport_parser(self, filelist):
     """Parse sosreport in format tar.xz.
 
-    1. Extract etc/os_release to get RHEL release
-    2. If 7.x, parse /var/log/messages and /var/log/cluster/corosync.log
+    1. Read the sosreport in one sequential pass
+    2. Extract etc/os_release to get RHEL release
+    3. If 7.x, parse /var/log/messages and /var/log/cluster/corosync.log
        If 8.x, parse /var/log/messages and /var/log/pacemaker/pacemaker.log
 
     Args:
       filelist: List of strings for sosreport names
-
-    Raises:
-      ReadError: An error occured when opening the tar file
-      FileNotFoundError: An error occured when the tar file doesn't exist
-      KeyError: An error occured when the file to extract was missing
     """
+    logs = {
+        '/var/log/messages': 's',
+        '/var/log/pacemaker/pacemaker.log': 'p',
+        '/var/log/cluster/corosync.log': 'p'
+    }
+    # etc/os-release is usually a link to usr/lib/os-release
+    texts = ('/etc/os-release', '/usr/lib/os-release')
     for file in filelist:
-      try:
-        t = tarfile.open(file, 'r')
-      except tarfile.ReadError:
-        logging.error(
-            'Cannot read the file %s. '
-            'Please manually extract the logs and parse them.', file)
+      result = self.tar_file_reader(file, logs, texts)
+      if result is None:
         continue
-      except FileNotFoundError:
-        logging.error('Cannot find the file %s. ', file)
-        continue
-      else:
-        with t:
-          try:
-            os_ver = 0
-            folder = os.path.commonprefix(t.getnames())
-            osfile = t.extractfile(f'{folder}/etc/os-release')
-            line = osfile.readline().decode('utf-8')
-            while line:
-              if re.search('VERSION_ID', line):
-                os_ver = line.split('\"')[1]
-                break
-              line = osfile.readline().decode('utf-8')
-          except KeyError:
-            logging.info('etc/os-release is missing.')
-          except EOFError:
-            logging.info('%s is corrupted or incomplete, please try to uncompress and use option s or p to parse individual files', file)
-            continue
+      folder, contents = result
 
-          logging.info('Parsing %s.', file)
-          if float(os_ver) >= 8:
-            self.compressed_file_parser(t, [folder, 'var/log/messages'], 'RHEL', 's')
-            self.compressed_file_parser(t, [folder, 'var/log/pacemaker/pacemaker.log'], 'RHEL', 'p')
-          else:
-            self.compressed_file_parser(t, [folder, 'var/log/messages'], 'RHEL', 's')
-            self.compressed_file_parser(t, [folder, 'var/log/cluster/corosync.log'], 'RHEL', 'p')
+      os_ver = 0
+      lines = contents.get(f'{folder}/etc/os-release')
+      if lines is None:
+        logging.info('etc/os-release is missing.')
+      else:
+        for line in lines:
+          if re.search('VERSION_ID', line):
+            os_ver = line.split('\"')[1]
+            break
+
+      logging.info('Parsing %s.', file)
+      if float(os_ver) >= 8:
+        self.compressed_file_parser(contents, [folder, 'var/log/messages'], 'RHEL')
+        self.compressed_file_parser(contents, [folder, 'var/log/pacemaker/pacemaker.log'], 'RHEL')
+      else:
+        self.compressed_file_parser(contents, [folder, 'var/log/messages'], 'RHEL')
+        self.compressed_file_parser(contents, [folder, 'var/log/cluster/corosync.log'], 'RHEL')
 
   def generate_output(self, output='logparser.out'):
     """Write all critical events to output file.
@@ -404,9 +637,8 @@ class LogParser():
       logging.error('Error executing the big query: %s.', str(err))
       sys.exit()
 
-    with open(output, 'w') as out:
-      for row in cursor:
-        out.writelines(' '.join(map(str, row)))
+    with open(output, 'w', buffering=1024 * 1024) as out:
+      out.writelines(row[0] + '\n' for row in cursor)
     logging.info('Please check output in file %s.', output)
 
   def execute_sql(self, sql, input_type):
@@ -445,41 +677,148 @@ class LogParser():
       logging.error('No such sql input type %s.', input_type)
       sys.exit()
 
-  def parse_log_line(self, logline, logtype):
-    """Format the timestamp in log line.
-
-    Filter log lines by key words depend on log file type. 
-    Insert the lines into the temp in memory DB.
+  def parse_log_line(self, logline):
+    """Format the timestamp in log line and split it into columns.
 
     Args:
       logline: String for log line
-      logtype: String for log type, 's' for system log, 'p' for pacemaker log
+
+    Returns:
+      Tuple of TIME, NODE, COMPONENT, PAYLOAD, None if there is no timestamp
     """
-    if logtype == 's':
-      pattern = self.system_log_keywords
-    elif logtype == 'p':
-      pattern = self.pacemaker_log_keywords
-    else:
-      logging.error('No such log type %s.', logtype)
+    timestamp = self.format_timestamp_from_logline(logline)
+    if timestamp:
+      if timestamp[1] == 1:
+        # Split the line into 4 components:
+        # timestamp, host, component, PAYLOAD
+        newline = self._ws_re.split(logline, 5)
+        # A line may have no component or PAYLOAD, e.g. Nov 22 00:00:07 node1 reboot
+        newline += [''] * (6 - len(newline))
+        host, component, payload = newline[3:]
+      elif timestamp[1] == 2:
+        # Split the line into 4 components:
+        # timestamp, host, component, PAYLOAD
+        newline = self._ws_re.split(logline, 3)
+        newline += [''] * (4 - len(newline))
+        host, component, payload = newline[1:]
+      # Remove '[number]' from component, e.g. pengine[1234]:
+      component, count = self._bracket_re.subn('', component, 1)
+      # Pacemaker 2 detail logs have it as a separate field after component,
+      # e.g. pacemaker-fenced    [5678] (remote_op_done)
+      if not count:
+        payload = self._leading_pid_re.sub('', payload, 1)
+      return (timestamp[0], host, component.strip(':').strip('/'), payload.rstrip('\r\n'))
+
+  def insert_records(self, records):
+    """Insert the parsed log lines into the temp in memory DB.
+
+    Args:
+      records: Iterable of tuples for parsed log lines
+    """
+    batch = self._batch
+    batch_size = self._BATCH_SIZE
+    for record in records:
+      batch.append(record)
+      if len(batch) >= batch_size:
+        self._flush()
+
+  def _flush(self):
+    """Insert all pending records into the temp in memory DB in one transaction.
+
+    Raises:
+      sqlite3.Error: An error occurred when inserting into the DB table
+    """
+    if not self._batch:
+      return
+    try:
+      self.conn.execute('BEGIN')
+      self.conn.executemany('INSERT INTO log VALUES (?,?,?,?)', self._batch)
+      self.conn.execute('COMMIT')
+    except sqlite3.Error as err:
+      logging.error('Error inserting into the DB table: %s.', str(err))
       sys.exit()
+    self._batch.clear()
 
-    if re.search(pattern, logline):
-      # Remove '[number]'
-      logline = re.sub(r'\[\d*\]', '', logline, 1)
-      timestamp = self.format_timestamp_from_logline(logline)
-      if timestamp:
-        if timestamp[1] == 1:
-          # Split the line into 4 components:
-          # timestamp, host, component, PAYLOAD
-          newline = re.split(r'\s+', logline, 5)
-          record = [str(timestamp[0]), newline[3], newline[4].strip(':').strip('/'), newline[5]]
-        elif timestamp[1] == 2:
-          # Split the line into 4 components:
-          # timestamp, host, component, PAYLOAD
-          newline = re.split(r'\s+', logline, 3)
-          record = [str(timestamp[0]), newline[1], newline[2].strip(':').strip('/'), newline[3]]
-        self.conn.execute('INSERT INTO log VALUES (?,?,?,?)', record)
-        self.conn.commit()
+  def build_keyword_filters(self):
+    """Build the functions to filter bytes log lines by key words of each type.
+
+    Match the keywords with Aho-Corasick if pyahocorasick is installed.
+    """
+    self._pac_ac = self.build_keyword_automaton(self._pac_keywords)
+    self._sys_ac = self.build_keyword_automaton(self._sys_keywords)
+    self._line_filter_by_type = {
+        's': self.build_keyword_filter(self._bytes_re_by_type['s'], self._sys_ac),
+        'p': self.build_keyword_filter(self._bytes_re_by_type['p'], self._pac_ac)
+    }
+
+  def build_keyword_regex(self, keywords):
+    """Build a regex of the keywords with the common prefixes factored out.
+
+    e.g. ['cli-ban', 'cli-prefer'] gives cli\-(?:ban|prefer), so the regex
+    engine checks the common prefix once instead of once per keyword.
+
+    Args:
+      keywords: List of strings for keywords
+
+    Returns:
+      String for the regex of the keywords
+    """
+    trie = {}
+    for keyword in keywords:
+      node = trie
+      for char in keyword:
+        node = node.setdefault(char, {})
+      # Mark the end of the keyword
+      node[''] = {}
+
+    def trie_to_regex(node):
+      # A line containing a keyword matches, longer keywords are not needed
+      if '' in node:
+        return ''
+      alternatives = [re.escape(char) + trie_to_regex(child)
+                      for char, child in node.items()]
+      if len(alternatives) == 1:
+        return alternatives[0]
+      return '(?:' + '|'.join(alternatives) + ')'
+
+    return trie_to_regex(trie)
+
+  def build_keyword_automaton(self, keywords):
+    """Build an Aho-Corasick automaton to search the keywords in one pass.
+
+    Args:
+      keywords: List of strings for keywords
+
+    Returns:
+      Automaton of the keywords, None if pyahocorasick is not installed
+    """
+    if ahocorasick is None:
+      return None
+
+    automaton = ahocorasick.Automaton()
+    for keyword in keywords:
+      automaton.add_word(keyword, keyword)
+    automaton.make_automaton()
+    return automaton
+
+  def build_keyword_filter(self, pattern, automaton):
+    """Build the function to check whether a bytes log line contains key words.
+
+    The automaton only searches str. The line is decoded as latin-1, which maps
+    each byte to one character, so the ASCII keywords match exactly the lines
+    the bytes regex matches.
+
+    Args:
+      pattern: Compiled bytes regex of the keywords
+      automaton: Aho-Corasick automaton of the keywords, or None
+
+    Returns:
+      Function which returns true if the log line contains key words
+    """
+    if automaton is None:
+      return pattern.search
+    return lambda line: next(
+        automaton.iter(line.decode('latin-1')), None) is not None
 
   def format_timestamp_from_logline(self, line):
     """Format the timestamp in log line.
@@ -493,28 +832,64 @@ class LogParser():
     Raises:
       ValueError: An error occured when formatting the timestamp
     """
-    # time format Nov 22 00:00:00
-    time_format1 = [r'\w{3}\s+\d+\s\d\d:\d\d:\d\d', '%Y %b %d %H:%M:%S']
-    # time format 2020-11-22T00:00:00
-    time_format2 = [r'\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d', '%Y-%m-%dT%H:%M:%S']
-
-    ts1 = re.search(time_format1[0], line)
-    ts2 = re.search(time_format2[0], line)
     try:
+      # time format Nov 22 00:00:00
+      ts1 = self._ts_re1.search(line)
       if ts1:
-        return [
-            datetime.datetime.strptime(
-                str(datetime.datetime.now().year) + ' ' + ts1.group(),
-                time_format1[1]), 1
-        ]
-      elif ts2:
-        return [datetime.datetime.strptime(ts2.group(), time_format2[1]), 2]
-      else:
-        pass
-    except ValueError:
+        return [self._format_ts1(ts1.group()), 1]
+      # time format 2020-11-22T00:00:00
+      ts2 = self._ts_re2.search(line)
+      if ts2:
+        return [self._format_ts2(ts2.group()), 2]
+    except (KeyError, ValueError):
       logging.error('Timestamp formatting failed.%s.', line)
       sys.exit()
 
+  def build_timestamp_caches(self):
+    """Cache the formatted timestamps by the raw timestamp string.
+
+    Many log lines share the same timestamp. The caches belong to this
+    instance, a cache on the method would keep every instance alive.
+    """
+    self._format_ts1 = functools.lru_cache(maxsize=1024)(self.format_timestamp1)
+    self._format_ts2 = functools.lru_cache(maxsize=1024)(self.format_timestamp2)
+
+  def format_timestamp1(self, timestamp):
+    """Format the timestamp in format Nov 22 00:00:00 with the current year.
+
+    The format is fixed, build the datetime from the regex groups directly
+    instead of the much slower strptime.
+
+    Args:
+      timestamp: String for timestamp in format Nov 22 00:00:00
+
+    Returns:
+      String for timestamp in format 2020-11-22 00:00:00
+
+    Raises:
+      KeyError: An error occured when the month is invalid
+      ValueError: An error occured when formatting the timestamp
+    """
+    month, day, hour, minute, second = self._ts_re1.match(timestamp).groups()
+    return str(
+        datetime.datetime(self._year, MONTHS[month.lower()], int(day),
+                          int(hour), int(minute), int(second)))
+
+  def format_timestamp2(self, timestamp):
+    """Format the timestamp in format 2020-11-22T00:00:00.
+
+    Args:
+      timestamp: String for timestamp in format 2020-11-22T00:00:00
+
+    Returns:
+      String for timestamp in format 2020-11-22 00:00:00
+
+    Raises:
+      ValueError: An error occured when formatting the timestamp
+    """
+    return str(
+        datetime.datetime(*map(int, self._ts_re2.match(timestamp).groups())))
+
   def format_timestamp_from_timeinput(self, time):
     """Format the timestamp in input argument.
 
@@ -540,6 +915,19 @@ class LogParser():
     logging.info('Timestamp format needs to be YYYY-MM-DD-HH:MM or YYYY-MM-DD.')
     sys.exit()
 
+  def __getstate__(self):
+    """Drop the DB connection, keyword filters and caches before pickling."""
+    state = self.__dict__.copy()
+    for key in ('conn', '_batch', '_pac_ac', '_sys_ac', '_line_filter_by_type',
+                '_format_ts1', '_format_ts2'):
+      state.pop(key, None)
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.build_keyword_filters()
+    self.build_timestamp_caches()
+
   def cleanup(self):
     self.conn.close()
 
@@ -0,0 +1,256 @@
+# ------------------------------------------------------------------------
+#Copyright 2021 Google LLC
+#
+#Licensed under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License.
+#You may obtain a copy of the License at
+#
+#    https://www.apache.org/licenses/LICENSE-2.0
+#
+#Unless required by applicable law or agreed to in writing, software
+#distributed under the License is distributed on an "AS IS" BASIS,
+#WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#See the License for the specific language governing permissions and
+#limitations under the License.
+# ------------------------------------------------------------------------
+
+import argparse
+import datetime
+import io
+import os
+import tarfile
+import tempfile
+import threading
+import unittest
+
+import logparser
+
+# A matched pacemaker log line without component and PAYLOAD
+SHORT_LINE = 'Nov 22 00:00:07 node1 reboot\n'
+FENCE_LINE = ("Nov 22 00:00:08 node1 pengine[1234]: notice: LogNodeActions: "
+              "* Fence (reboot) node2 'peer is no longer part of the cluster'\n")
+
+# Pacemaker 2 detail log lines, the pid is a separate field after component
+PACEMAKER2_LINES = (
+    "Nov 22 00:00:02 node1 pacemaker-fenced    [5678] (remote_op_done)  "
+    "notice: Operation 'reboot' targeting node2 on node1 for "
+    "pacemaker-controld.1234@node1: OK\n"
+    "Nov 22 00:00:03 node1 pacemaker-schedulerd[1234] (LogNodeActions)  "
+    "notice:  * Fence (reboot) node2 'peer is no longer part of the cluster'\n")
+
+
+def fence_line(time, node):
+  return (f'Nov 22 {time} {node} pengine[1]: notice: LogNodeActions: '
+          "* Fence (reboot) node3 'peer is no longer part of the cluster'\n")
+
+
+class LogParserTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.year = datetime.datetime.now().year
+
+  def tearDown(self):
+    self.tmpdir.cleanup()
+    super().tearDown()
+
+  def write_file(self, name, text):
+    path = os.path.join(self.tmpdir.name, name)
+    with open(path, 'w') as f:
+      f.write(text)
+    return path
+
+  def make_parser(self, **kwargs):
+    variables = argparse.Namespace(
+        s=None, p=None, hb=None, sos=None, b=None, e=None,
+        o=[os.path.join(self.tmpdir.name, 'logparser.out')], d=False, x=False)
+    for key, value in kwargs.items():
+      setattr(variables, key, value)
+    return logparser.LogParser(variables)
+
+  def test_parse_log_line_without_payload(self):
+    parser = self.make_parser(p=['pacemaker.log'])
+    self.assertEqual(
+        parser.parse_log_line(SHORT_LINE.rstrip('\n')),
+        (f'{self.year}-11-22 00:00:07', 'node1', 'reboot', ''))
+    self.assertEqual(
+        parser.parse_log_line('2020-11-22T00:00:07 node1'),
+        ('2020-11-22 00:00:07', 'node1', '', ''))
+    parser.cleanup()
+
+  def test_pacemaker_log_with_short_line(self):
+    log = self.write_file('pacemaker.log', SHORT_LINE + FENCE_LINE)
+    parser = self.make_parser(p=[log])
+    parser.logparser()
+    with open(parser.output_file[0]) as f:
+      self.assertEqual(
+          f.read(),
+          f'{self.year}-11-22 00:00:08 node1 pengine notice: LogNodeActions: '
+          "* Fence (reboot) node2 'peer is no longer part of the cluster'\n")
+
+  def write_tar(self, name, members):
+    """Write a tar file of (name, text) members, text None for a folder.
+
+    A TarInfo member, e.g. for a link, is added as it is.
+    """
+    path = os.path.join(self.tmpdir.name, name)
+    with tarfile.open(path, 'w:bz2') as t:
+      for member in members:
+        if isinstance(member, tarfile.TarInfo):
+          t.addfile(member)
+          continue
+        member, text = member
+        info = tarfile.TarInfo(member)
+        if text is None:
+          info.type = tarfile.DIRTYPE
+          t.addfile(info)
+          continue
+        data = text.encode()
+        info.size = len(data)
+        t.addfile(info, io.BytesIO(data))
+    return path
+
+  def test_hb_report_with_short_line(self):
+    hb_report = self.write_tar(
+        'hb_report.tar.bz2',
+        [('hb_report/members.txt', 'node1\n'),
+         ('hb_report/node1/pacemaker.log', SHORT_LINE + FENCE_LINE)])
+    parser = self.make_parser(hb=[hb_report])
+    parser.logparser()
+    with open(parser.output_file[0]) as f:
+      self.assertEqual(
+          f.read(),
+          f'{self.year}-11-22 00:00:08 node1 pengine notice: LogNodeActions: '
+          "* Fence (reboot) node2 'peer is no longer part of the cluster'\n")
+
+  def test_pacemaker2_log_pid_removed(self):
+    log = self.write_file('pacemaker.log', PACEMAKER2_LINES)
+    parser = self.make_parser(p=[log])
+    parser.logparser()
+    with open(parser.output_file[0]) as f:
+      self.assertEqual(
+          f.read(),
+          f'{self.year}-11-22 00:00:02 node1 pacemaker-fenced (remote_op_done)  '
+          "notice: Operation 'reboot' targeting node2 on node1 for "
+          'pacemaker-controld.1234@node1: OK\n'
+          f'{self.year}-11-22 00:00:03 node1 pacemaker-schedulerd '
+          "(LogNodeActions)  notice:  * Fence (reboot) node2 'peer is no longer "
+          "part of the cluster'\n")
+
+  def test_pacemaker_log_from_pipe(self):
+    log = os.path.join(self.tmpdir.name, 'pacemaker.fifo')
+    os.mkfifo(log)
+
+    def write_fifo():
+      with open(log, 'w') as f:
+        f.write(SHORT_LINE + FENCE_LINE)
+
+    writer = threading.Thread(target=write_fifo)
+    writer.start()
+    parser = self.make_parser(p=[log])
+    parser.logparser()
+    writer.join()
+    with open(parser.output_file[0]) as f:
+      self.assertEqual(
+          f.read(),
+          f'{self.year}-11-22 00:00:08 node1 pengine notice: LogNodeActions: '
+          "* Fence (reboot) node2 'peer is no longer part of the cluster'\n")
+
+  def test_hb_report_top_folder(self):
+    layouts = {
+        # tar cjf hb_report.tar.bz2 ./hb_report
+        'dot_folder.tar.bz2': ['./hb_report', './hb_report/members.txt',
+                               './hb_report/node1',
+                               './hb_report/node1/pacemaker.log'],
+        # tar cjf hb_report.tar.bz2 -C hb_report .
+        'dot.tar.bz2': ['.', './members.txt', './node1',
+                        './node1/pacemaker.log'],
+    }
+    for name, members in layouts.items():
+      with self.subTest(layout=name):
+        texts = {'members.txt': 'node1\n', 'pacemaker.log': FENCE_LINE}
+        hb_report = self.write_tar(
+            name, [(member, texts.get(os.path.basename(member)))
+                   for member in members])
+        parser = self.make_parser(hb=[hb_report])
+        parser.logparser()
+        with open(parser.output_file[0]) as f:
+          self.assertEqual(
+              f.read(),
+              f'{self.year}-11-22 00:00:08 node1 pengine notice: '
+              "LogNodeActions: * Fence (reboot) node2 'peer is no longer part "
+              "of the cluster'\n")
+
+  def test_pacemaker_log_keywords(self):
+    # crit: and cli-prefer lines are selected by the query, so the keywords
+    # must let them through
+    log = self.write_file(
+        'pacemaker.log',
+        'Nov 22 00:00:09 node1 crmd[1]:     crit: tengine_stonith_notify: We '
+        'were allegedly just fenced by node2 for node2!\n'
+        'Nov 22 00:00:10 node1 cib[2]:     info: cib_perform_op: ++ '
+        '/cib/configuration/constraints:  <rsc_location id="cli-prefer-grp" '
+        'rsc="grp" role="Started" node="node1" score="INFINITY"/>\n')
+    parser = self.make_parser(p=[log])
+    parser.logparser()
+    with open(parser.output_file[0]) as f:
+      self.assertEqual(
+          f.read(),
+          f'{self.year}-11-22 00:00:09 node1 crmd crit: tengine_stonith_notify: '
+          'We were allegedly just fenced by node2 for node2!\n'
+          f'{self.year}-11-22 00:00:10 node1 cib info: cib_perform_op: ++ '
+          '/cib/configuration/constraints:  <rsc_location id="cli-prefer-grp" '
+          'rsc="grp" role="Started" node="node1" score="INFINITY"/>\n')
+
+  def test_sosreport_os_release_link(self):
+    # RHEL 8 logs to pacemaker.log, corosync.log must not be parsed
+    corosync_line = FENCE_LINE.replace('00:00:08', '00:00:09')
+    for link_type, link_name in ((tarfile.SYMTYPE, '../usr/lib/os-release'),
+                                 (tarfile.LNKTYPE,
+                                  'sosreport/usr/lib/os-release')):
+      with self.subTest(link_type=link_type):
+        link = tarfile.TarInfo('sosreport/etc/os-release')
+        link.type = link_type
+        link.linkname = link_name
+        sosreport = self.write_tar(
+            'sosreport.tar.bz2',
+            [('sosreport', None), link,
+             ('sosreport/usr/lib/os-release', 'NAME="Red Hat Enterprise '
+              'Linux"\nVERSION_ID="8.4"\n'),
+             ('sosreport/var/log/pacemaker/pacemaker.log', FENCE_LINE),
+             ('sosreport/var/log/cluster/corosync.log', corosync_line)])
+        parser = self.make_parser(sos=[sosreport])
+        parser.logparser()
+        with open(parser.output_file[0]) as f:
+          self.assertEqual(
+              f.read(),
+              f'{self.year}-11-22 00:00:08 node1 pengine notice: '
+              "LogNodeActions: * Fence (reboot) node2 'peer is no longer part "
+              "of the cluster'\n")
+
+  def test_output_order(self):
+    # A single log is written in file order, even if the clock went back
+    log1 = self.write_file(
+        'node1.log', fence_line('00:00:03', 'node1') +
+        fence_line('00:00:01', 'node1'))
+    parser = self.make_parser(p=[log1])
+    parser.logparser()
+    with open(parser.output_file[0]) as f:
+      self.assertEqual([line.split()[1:3] for line in f],
+                       [['00:00:03', 'node1'], ['00:00:01', 'node1']])
+
+    # Several logs are merged by time, equal times stay in file order
+    log2 = self.write_file(
+        'node2.log', fence_line('00:00:01', 'node2') +
+        fence_line('00:00:02', 'node2'))
+    parser = self.make_parser(p=[log1, log2])
+    parser.logparser()
+    with open(parser.output_file[0]) as f:
+      self.assertEqual([line.split()[1:3] for line in f],
+                       [['00:00:01', 'node1'], ['00:00:01', 'node2'],
+                        ['00:00:02', 'node2'], ['00:00:03', 'node1']])
+
+
+if __name__ == '__main__':
+  unittest.main()